@@ -5,56 +5,108 @@ Real-time Web Dashboard for IIoT Monitoring
 from flask import Flask, render_template, jsonify
 from flask_socketio import SocketIO, emit
 import paho.mqtt.client as mqtt
-import json
+import argparse
+from mqtt_tuning import configure_client, pin_thread, report_pinning, tune_socket
+from log_config import setup_logging
+from sensor_schema import FLEET_TOPIC, expand_reading
+import orjson
 import threading
 import time
+import collections
+import logging
+from queue import Queue, Full
 from datetime import datetime
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
 socketio = SocketIO(app, cors_allowed_origins="*")
 
-# Global data storage
+logger = logging.getLogger(__name__)
+
+# Global data storage (live state, written only by the MQTT worker under _data_lock)
 dashboard_data = {
     "machines": {},
-    "alerts": [],
+    "alerts": collections.deque(maxlen=100),
     "statistics": {
         "total_readings": 0,
         "total_anomalies": 0,
         "active_machines": 0
     }
 }
+_data_lock = threading.Lock()
+
+# MQTT messages dropped because the queue was full (written only by paho's thread)
+_dropped_messages = 0
+
+# Read-only copy of dashboard_data served by the HTTP routes. It is replaced
+# wholesale (a single atomic reference assignment), never mutated in place.
+dashboard_snapshot = {
+    "machines": {},
+    "alerts": [],
+    "statistics": {**dashboard_data["statistics"], "dropped_messages": 0}
+}
 
 # MQTT Client
 mqtt_client = None
 
+# Raw MQTT messages waiting for the worker thread (dropped when full)
+_q = Queue(maxsize=10000)
+
+# Web client updates, coalesced and emitted in batches
+EMIT_INTERVAL = 0.05  # seconds (~20 Hz)
+_pending_updates = {}
+_pending_alerts = []
+_lock = threading.Lock()
+
 def on_connect(client, userdata, flags, rc):
     """MQTT connection callback"""
     if rc == 0:
-        print("✓ Dashboard connected to MQTT Broker")
+        logger.info("✓ Dashboard connected to MQTT Broker")
+        tune_socket(client)
         # Subscribe to topics
-        client.subscribe("factory/machines/+/sensors", qos=1)
-        client.subscribe("factory/alerts/anomaly", qos=2)
-        print("✓ Subscribed to sensor and alert topics")
+        client.subscribe("factory/machines/+/sensors", qos=0)
+        client.subscribe(FLEET_TOPIC, qos=0)
+        client.subscribe("factory/alerts/anomaly", qos=1)
+        logger.info("✓ Subscribed to sensor and alert topics")
     else:
-        print(f"✗ Connection failed with code {rc}")
+        logger.error("✗ Connection failed with code %s", rc)
 
 def on_message(client, userdata, msg):
-    """MQTT message callback"""
+    """MQTT message callback - only queues the raw message to keep paho's thread free"""
+    global _dropped_messages
+    
     try:
-        data = json.loads(msg.payload.decode())
-        topic = msg.topic
-        
-        # Handle sensor data
-        if "sensors" in topic:
-            handle_sensor_data(data)
+        _q.put_nowait((msg.topic, msg.payload))
+    except Full:
+        _dropped_messages += 1
+
+def process_messages():
+    """Background thread: process queued MQTT messages in broker delivery order"""
+    while True:
+        topic, payload = _q.get()
+        _handle_raw(topic, payload)
+
+def _handle_raw(topic, payload):
+    """Decode and process one MQTT message (runs on the worker thread)"""
+    try:
+        data = orjson.loads(payload)
         
-        # Handle alerts
-        elif "alerts" in topic:
-            handle_alert(data)
+        with _data_lock:
+            # Handle batched fleet sensor data
+            if topic == FLEET_TOPIC:
+                for reading in data:
+                    handle_sensor_data(expand_reading(reading))
+            
+            # Handle sensor data
+            elif "sensors" in topic:
+                handle_sensor_data(expand_reading(data))
+            
+            # Handle alerts
+            elif "alerts" in topic:
+                handle_alert(data)
             
     except Exception as e:
-        print(f"Error processing MQTT message: {e}")
+        logger.error("Error processing MQTT message: %s", e)
 
 def handle_sensor_data(data):
     """Process sensor data"""
@@ -63,7 +115,7 @@ def handle_sensor_data(data):
     # Update machine data
     if machine_id not in dashboard_data["machines"]:
         dashboard_data["machines"][machine_id] = {
-            "readings": [],
+            "readings": collections.deque(maxlen=50),
             "status": "normal",
             "last_update": None
         }
@@ -72,24 +124,18 @@ def handle_sensor_data(data):
     # Store reading (keep last 50)
     machine_info = dashboard_data["machines"][machine_id]
     machine_info["readings"].append(data)
-    if len(machine_info["readings"]) > 50:
-        machine_info["readings"].pop(0)
     
     machine_info["last_update"] = data["timestamp"]
     dashboard_data["statistics"]["total_readings"] += 1
     
-    # Emit to web clients
-    socketio.emit('sensor_update', {
-        'machine_id': machine_id,
-        'data': data
-    })
+    # Queue for the next batch to web clients (latest reading per machine)
+    with _lock:
+        _pending_updates[machine_id] = data
 
 def handle_alert(alert):
     """Process anomaly alert"""
     # Store alert (keep last 100)
-    dashboard_data["alerts"].insert(0, alert)
-    if len(dashboard_data["alerts"]) > 100:
-        dashboard_data["alerts"].pop()
+    dashboard_data["alerts"].appendleft(alert)
     
     dashboard_data["statistics"]["total_anomalies"] += 1
     
@@ -98,8 +144,57 @@ def handle_alert(alert):
     if machine_id in dashboard_data["machines"]:
         dashboard_data["machines"][machine_id]["status"] = "anomaly"
     
-    # Emit to web clients
-    socketio.emit('alert', alert)
+    # Queue for the next batch to web clients
+    with _lock:
+        _pending_alerts.append(alert)
+
+def publish_snapshot():
+    """Copy the live dashboard data and publish it for lock-free readers"""
+    global dashboard_snapshot
+    
+    with _data_lock:
+        snapshot = {
+            "machines": {
+                machine_id: {**info, "readings": list(info["readings"])}
+                for machine_id, info in dashboard_data["machines"].items()
+            },
+            "alerts": list(dashboard_data["alerts"]),
+            "statistics": {
+                **dashboard_data["statistics"],
+                "dropped_messages": _dropped_messages
+            }
+        }
+    
+    dashboard_snapshot = snapshot
+
+def emit_batches():
+    """Background task: push coalesced updates to web clients and refresh the snapshot"""
+    global _pending_updates, _pending_alerts
+    
+    published_drops = 0
+    
+    while True:
+        socketio.sleep(EMIT_INTERVAL)
+        
+        with _lock:
+            updates, _pending_updates = _pending_updates, {}
+            alerts, _pending_alerts = _pending_alerts, []
+        
+        # Refresh on any state change, including drops while ingest is saturated
+        dropped = _dropped_messages
+        if updates or alerts or dropped != published_drops:
+            publish_snapshot()
+            published_drops = dropped
+        
+        if updates:
+            # Send the server's reading count: a batch keeps only the latest
+            # reading per machine, so clients cannot count readings themselves
+            socketio.emit('sensor_batch', {
+                'machines': updates,
+                'total_readings': dashboard_data["statistics"]["total_readings"]
+            })
+        if alerts:
+            socketio.emit('alerts_batch', alerts)
 
 def start_mqtt_client():
     """Start MQTT client in background thread"""
@@ -108,12 +203,13 @@ def start_mqtt_client():
     mqtt_client = mqtt.Client(client_id=f"dashboard_{int(time.time())}")
     mqtt_client.on_connect = on_connect
     mqtt_client.on_message = on_message
+    configure_client(mqtt_client)
     
     try:
         mqtt_client.connect("broker.hivemq.com", 1883, 60)
         mqtt_client.loop_forever()
     except Exception as e:
-        print(f"MQTT connection error: {e}")
+        logger.error("MQTT connection error: %s", e)
 
 # Flask Routes
 @app.route('/')
@@ -124,13 +220,13 @@ def index():
 @app.route('/api/data')
 def get_data():
     """API endpoint for current data"""
-    return jsonify(dashboard_data)
+    return jsonify(dashboard_snapshot)
 
 @app.route('/api/machines')
 def get_machines():
     """Get list of machines"""
     machines = []
-    for machine_id, info in dashboard_data["machines"].items():
+    for machine_id, info in dashboard_snapshot["machines"].items():
         latest = info["readings"][-1] if info["readings"] else {}
         machines.append({
             "id": machine_id,
@@ -143,25 +239,34 @@ def get_machines():
 @app.route('/api/alerts')
 def get_alerts():
     """Get recent alerts"""
-    return jsonify(dashboard_data["alerts"][:20])
+    return jsonify(dashboard_snapshot["alerts"][:20])
 
 @app.route('/api/statistics')
 def get_statistics():
     """Get system statistics"""
-    return jsonify(dashboard_data["statistics"])
+    return jsonify(dashboard_snapshot["statistics"])
 
 @socketio.on('connect')
 def handle_connect():
     """Handle web socket connection"""
-    print(f"✓ Client connected: {datetime.now()}")
+    logger.info("✓ Client connected: %s", datetime.now())
     emit('connection_response', {'status': 'connected'})
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """Handle web socket disconnection"""
-    print(f"✗ Client disconnected: {datetime.now()}")
+    logger.info("✗ Client disconnected: %s", datetime.now())
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="IIoT dashboard server")
+    parser.add_argument("--pin-cpu", type=int, default=None,
+                        help="Pin the MQTT network thread to this CPU core")
+    parser.add_argument("--realtime", action="store_true",
+                        help="Use SCHED_FIFO for the pinned thread (needs CAP_SYS_NICE)")
+    args = parser.parse_args()
+    
+    log_listener = setup_logging(logging.INFO)
+    
     print("="*60)
     print("🌐 IIOT DASHBOARD SERVER")
     print("="*60)
@@ -171,6 +276,17 @@ if __name__ == '__main__':
     mqtt_thread = threading.Thread(target=start_mqtt_client, daemon=True)
     mqtt_thread.start()
     
+    if args.pin_cpu is not None:
+        pinned, realtime_enabled = pin_thread(mqtt_thread, args.pin_cpu, args.realtime)
+        report_pinning(pinned, realtime_enabled, args.pin_cpu, args.realtime)
+    
+    # Start MQTT message worker
+    worker_thread = threading.Thread(target=process_messages, daemon=True)
+    worker_thread.start()
+    
+    # Start batched emits to web clients
+    socketio.start_background_task(emit_batches)
+    
     time.sleep(2)  # Wait for MQTT to connect
     
     print("✓ Dashboard ready")
@@ -178,4 +294,7 @@ if __name__ == '__main__':
     print("="*60 + "\n")
     
     # Start Flask app
-    socketio.run(app, host='0.0.0.0', port=5000, debug=False)
+    try:
+        socketio.run(app, host='0.0.0.0', port=5000, debug=False)
+    finally:
+        log_listener.stop()
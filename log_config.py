@@ -0,0 +1,32 @@
+"""
+Logging Configuration
+Non-blocking console logging shared by the ML monitor and dashboard
+"""
+
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from queue import Queue
+
+def setup_logging(level=logging.INFO):
+    """
+    Route all log records through a queue so callers never block on stdout
+    
+    Args:
+        level: Root logger level (DEBUG also shows normal-operation readings)
+    
+    Returns:
+        The started QueueListener (call stop() to flush on shutdown)
+    """
+    log_queue = Queue(-1)
+    
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter("%(message)s"))
+    
+    listener = QueueListener(log_queue, console)
+    
+    root = logging.getLogger()
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(level)
+    
+    listener.start()
+    return listener
@@ -4,14 +4,61 @@ Receives sensor data and performs anomaly detection
 """
 
 import paho.mqtt.client as mqtt
-import json
+import argparse
+import operator
+from mqtt_tuning import configure_client, pin_thread, report_pinning, tune_socket
+from log_config import setup_logging
+from sensor_schema import FLEET_TOPIC, expand_reading
+import orjson
 import numpy as np
-from datetime import datetime
 from collections import deque
 from sklearn.ensemble import IsolationForest
 from sklearn.preprocessing import StandardScaler
+from sklearn.pipeline import make_pipeline
 import pickle
+import logging
+import threading
 import time
+from queue import Queue, Empty, Full
+
+# Optional ONNX Runtime acceleration (falls back to scikit-learn)
+try:
+    import onnxruntime as ort
+    from skl2onnx import convert_sklearn
+    from skl2onnx.common.data_types import FloatTensorType
+    ONNX_AVAILABLE = True
+except ImportError:
+    ONNX_AVAILABLE = False
+
+ONNX_MODEL_PATH = 'models/anomaly_detector.onnx'
+
+SEVERITY_ICON = {
+    "CRITICAL": "🔴",
+    "WARNING": "🟡",
+    "INFO": "🔵"
+}
+
+# Maintenance thresholds: temperature, vibration, current, -rpm (RPM is a lower bound)
+THRESHOLDS = np.array([80, 4.0, 15, -1400], dtype=np.float32)
+MESSAGES = (
+    "Temperature exceeds safe threshold",
+    "Excessive vibration detected",
+    "High current draw",
+    "RPM below optimal range"
+)
+
+logger = logging.getLogger(__name__)
+
+# Anomaly detection batching
+BATCH_SIZE = 256
+BATCH_INTERVAL = 0.05  # seconds between batch dispatches
+MAX_PENDING_MESSAGES = 10000  # raw MQTT messages buffered before dropping
+NUM_FEATURES = 5
+
+# Model features, in column order
+FEATURE_KEYS = ("temperature", "vibration", "current", "pressure", "rpm")
+_FEATURE_KEY_SET = frozenset(FEATURE_KEYS)
+_GET = operator.itemgetter(*FEATURE_KEYS)
 
 class MLPredictiveMonitor:
     """ML-based monitoring system for predictive maintenance"""
@@ -20,6 +67,7 @@ class MLPredictiveMonitor:
         self.client = mqtt.Client(client_id=f"ml_monitor_{int(time.time())}")
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
+        configure_client(self.client)
         
         # Data storage for each machine
         self.machine_data = {}
@@ -29,85 +77,147 @@ class MLPredictiveMonitor:
         self.model = None
         self.scaler = StandardScaler()
         self.model_trained = False
-        self.training_data = []
+        self.onnx_session = None
+        self._mean = None
+        self._inv_scale = None
         self.min_training_samples = 30
+        self.training_data = np.empty((self.min_training_samples, NUM_FEATURES), dtype=np.float32)
+        self._ntrain = 0
+        
+        # Raw MQTT messages waiting for batched anomaly detection
+        self._pending = Queue(maxsize=MAX_PENDING_MESSAGES)
+        self._scratch = np.empty((BATCH_SIZE, NUM_FEATURES), dtype=np.float32)
+        self._stop_event = threading.Event()
+        self._worker = None
         
         # Statistics
         self.total_readings = 0
         self.anomalies_detected = 0
+        self.dropped_messages = 0
         
     def on_connect(self, client, userdata, flags, rc):
         if rc == 0:
-            print("✓ ML Monitor connected to MQTT Broker")
+            logger.info("✓ ML Monitor connected to MQTT Broker")
+            tune_socket(client)
             # Subscribe to all machine sensors
-            client.subscribe("factory/machines/+/sensors", qos=1)
-            print("✓ Subscribed to: factory/machines/+/sensors")
+            client.subscribe("factory/machines/+/sensors", qos=0)
+            client.subscribe(FLEET_TOPIC, qos=0)
+            logger.info("✓ Subscribed to: factory/machines/+/sensors, %s", FLEET_TOPIC)
         else:
-            print(f"✗ Connection failed with code {rc}")
+            logger.error("✗ Connection failed with code %s", rc)
     
     def on_message(self, client, userdata, msg):
-        """Process incoming sensor data"""
+        """Queue the raw message for the worker - keeps paho's network thread free"""
         try:
-            data = json.loads(msg.payload.decode())
-            self.process_sensor_data(data)
-        except Exception as e:
-            print(f"Error processing message: {e}")
+            self._pending.put_nowait((msg.topic, msg.payload))
+        except Full:
+            self.dropped_messages += 1
     
-    def process_sensor_data(self, data):
-        """Process and analyze sensor readings"""
-        machine_id = data["machine_id"]
-        self.total_readings += 1
-        
-        # Initialize storage for new machine
-        if machine_id not in self.machine_data:
-            self.machine_data[machine_id] = {
-                "readings": deque(maxlen=50),
-                "alerts": []
-            }
-        
-        # Store reading
-        self.machine_data[machine_id]["readings"].append(data)
-        
-        # Extract features for ML
-        features = self.extract_features(data)
+    def process_pending(self):
+        """Worker loop: drain queued messages and process them in batches"""
+        while not self._stop_event.wait(BATCH_INTERVAL):
+            batch = []
+            while True:
+                try:
+                    topic, payload = self._pending.get_nowait()
+                except Empty:
+                    break
+                
+                try:
+                    data = orjson.loads(payload)
+                    readings = data if topic == FLEET_TOPIC else [data]
+                except Exception as e:
+                    logger.error("Error processing message: %s", e)
+                    continue
+                
+                # Validate each reading on its own so one bad reading
+                # does not drop the rest of its message or batch
+                for reading in readings:
+                    try:
+                        batch.append(self.validate_reading(expand_reading(reading)))
+                    except Exception as e:
+                        logger.error("Dropping invalid reading: %s", e)
+            
+            if not batch:
+                continue
+            
+            try:
+                self.process_sensor_batch(batch)
+            except Exception as e:
+                logger.error("Error processing batch: %s", e)
+    
+    def process_sensor_batch(self, batch):
+        """Process and analyze a batch of sensor readings"""
+        rows = []
+        log_normal = logger.isEnabledFor(logging.DEBUG)
         
-        # Collect training data
-        if not self.model_trained:
-            self.training_data.append(features)
+        for data in batch:
+            machine_id = data["machine_id"]
+            self.total_readings += 1
+            
+            # Initialize storage for new machine
+            if machine_id not in self.machine_data:
+                self.machine_data[machine_id] = {
+                    "readings": deque(maxlen=50),
+                    "alerts": []
+                }
+            
+            # Store reading
+            self.machine_data[machine_id]["readings"].append(data)
             
-            if len(self.training_data) >= self.min_training_samples:
-                self.train_model()
+            # Extract features for ML
+            features = self.extract_features(data)
+            
+            # Collect training data
+            if not self.model_trained:
+                self.training_data[self._ntrain] = features
+                self._ntrain += 1
+                
+                if self._ntrain >= self.min_training_samples:
+                    self.train_model()
+            
+            # Queue for anomaly detection once the model is ready
+            if self.model_trained:
+                rows.append((machine_id, data, features))
         
-        # Perform anomaly detection if model is ready
-        if self.model_trained:
-            is_anomaly, anomaly_score = self.detect_anomaly(features)
+        # Perform anomaly detection in chunks of BATCH_SIZE
+        for start in range(0, len(rows), BATCH_SIZE):
+            chunk = rows[start:start + BATCH_SIZE]
+            is_anomaly, scores = self.detect_anomaly([row[2] for row in chunk])
             
-            if is_anomaly:
-                self.handle_anomaly(machine_id, data, anomaly_score)
-            else:
-                self.log_normal_operation(machine_id, data)
+            for (machine_id, data, _), anomalous, score in zip(chunk, is_anomaly, scores):
+                if anomalous:
+                    self.handle_anomaly(machine_id, data, score)
+                elif log_normal:
+                    self.log_normal_operation(machine_id, data)
+    
+    def validate_reading(self, data):
+        """Reject readings without an id/timestamp and fill missing features with 0, at ingress"""
+        if "machine_id" not in data or "timestamp" not in data:
+            raise ValueError(f"missing machine_id or timestamp: {data}")
+        
+        if not _FEATURE_KEY_SET.issubset(data):
+            for key in FEATURE_KEYS:
+                data.setdefault(key, 0)
+        return data
     
     def extract_features(self, data):
-        """Extract relevant features from sensor data"""
-        return [
-            data.get("temperature", 0),
-            data.get("vibration", 0),
-            data.get("current", 0),
-            data.get("pressure", 0),
-            data.get("rpm", 0)
-        ]
+        """Extract relevant features from sensor data (validated by validate_reading)"""
+        return _GET(data)
     
     def train_model(self):
         """Train the Isolation Forest model"""
-        print("\n" + "="*60)
-        print("🧠 Training ML Model...")
-        print("="*60)
+        logger.info("\n%s\n🧠 Training ML Model...\n%s", "="*60, "="*60)
         
-        X = np.array(self.training_data)
+        X = self.training_data[:self._ntrain]
         
         # Normalize features
         X_scaled = self.scaler.fit_transform(X)
         
+        # Cache scaler parameters for in-place scaling in detect_anomaly
+        self._mean = self.scaler.mean_.astype(np.float32)
+        self._inv_scale = (1.0 / self.scaler.scale_).astype(np.float32)
+        
         # Train Isolation Forest
         self.model = IsolationForest(
             contamination=0.15,  # Expected anomaly rate
@@ -118,29 +228,61 @@ class MLPredictiveMonitor:
         
         self.model_trained = True
         
-        print(f"✓ Model trained on {len(self.training_data)} samples")
-        print(f"✓ Features: temperature, vibration, current, pressure, rpm")
-        print("="*60 + "\n")
+        logger.info("✓ Model trained on %d samples\n"
+                    "✓ Features: temperature, vibration, current, pressure, rpm\n%s\n",
+                    self._ntrain, "="*60)
         
         # Save model
         with open('models/anomaly_detector.pkl', 'wb') as f:
             pickle.dump({'model': self.model, 'scaler': self.scaler}, f)
-        print("✓ Model saved to models/anomaly_detector.pkl\n")
+        logger.info("✓ Model saved to models/anomaly_detector.pkl\n")
+        
+        if ONNX_AVAILABLE:
+            self.export_onnx()
+    
+    def export_onnx(self):
+        """Compile scaler + Isolation Forest into a single ONNX Runtime session"""
+        try:
+            onnx_model = convert_sklearn(
+                make_pipeline(self.scaler, self.model),
+                initial_types=[("X", FloatTensorType([None, NUM_FEATURES]))],
+                target_opset={"": 15, "ai.onnx.ml": 3}
+            )
+            with open(ONNX_MODEL_PATH, 'wb') as f:
+                f.write(onnx_model.SerializeToString())
+            
+            self.onnx_session = ort.InferenceSession(
+                ONNX_MODEL_PATH,
+                providers=["CPUExecutionProvider"]
+            )
+            logger.info("✓ ONNX Runtime inference enabled (%s)\n", ONNX_MODEL_PATH)
+        except Exception as e:
+            self.onnx_session = None
+            logger.warning("ONNX export failed, using scikit-learn inference: %s\n", e)
     
     def detect_anomaly(self, features):
-        """Detect if current reading is anomalous"""
-        X = np.array([features])
-        X_scaled = self.scaler.transform(X)
+        """Detect which readings in a batch (at most BATCH_SIZE rows) are anomalous"""
+        n = len(features)
+        X = self._scratch[:n]
+        X[:] = features
+        
+        if self.onnx_session is not None:
+            # Scaler is fused into the graph; ONNX scores are decision_function
+            # values, so shift by offset_ to match score_samples
+            labels, scores = self.onnx_session.run(None, {"X": X})
+            return labels.ravel() == -1, scores.ravel() + self.model.offset_
         
-        # Predict (-1 for anomaly, 1 for normal)
-        prediction = self.model.predict(X_scaled)[0]
+        # Standardize in place on the scratch buffer: (X - mean) / scale
+        np.subtract(X, self._mean, out=X)
+        np.multiply(X, self._inv_scale, out=X)
         
-        # Get anomaly score
-        score = self.model.score_samples(X_scaled)[0]
+        # Get anomaly scores (single pass over the trees)
+        scores = self.model.score_samples(X)
         
-        is_anomaly = (prediction == -1)
+        # Same rule as predict(): anomaly when score_samples < offset_
+        is_anomaly = scores < self.model.offset_
         
-        return is_anomaly, score
+        return is_anomaly, scores
     
     def handle_anomaly(self, machine_id, data, score):
         """Handle detected anomaly"""
@@ -169,30 +311,33 @@ class MLPredictiveMonitor:
         # Publish alert
         self.client.publish(
             "factory/alerts/anomaly",
-            json.dumps(alert),
-            qos=2
+            orjson.dumps(alert),
+            qos=1
         )
         
         # Display alert
-        severity_icon = {
-            "CRITICAL": "🔴",
-            "WARNING": "🟡",
-            "INFO": "🔵"
-        }
-        
-        print(f"\n{'='*60}")
-        print(f"{severity_icon[alert['severity']]} ANOMALY DETECTED!")
-        print(f"{'='*60}")
-        print(f"Alert ID: {alert['alert_id']}")
-        print(f"Machine: {machine_id}")
-        print(f"Time: {datetime.fromisoformat(data['timestamp']).strftime('%Y-%m-%d %H:%M:%S')}")
-        print(f"Severity: {alert['severity']}")
-        print(f"Anomaly Score: {alert['anomaly_score']:.4f}")
-        print(f"\nMetrics:")
-        for key, value in alert['metrics'].items():
-            print(f"  - {key.capitalize()}: {value}")
-        print(f"\n💡 Recommendation: {alert['recommendation']}")
-        print(f"{'='*60}\n")
+        if logger.isEnabledFor(logging.WARNING):
+            metrics = "\n".join(
+                f"  - {key.capitalize()}: {value}" for key, value in alert['metrics'].items()
+            )
+            logger.warning(
+                "\n%s\n%s ANOMALY DETECTED!\n%s\n"
+                "Alert ID: %s\n"
+                "Machine: %s\n"
+                "Time: %s\n"
+                "Severity: %s\n"
+                "Anomaly Score: %.4f\n"
+                "\nMetrics:\n%s\n"
+                "\n💡 Recommendation: %s\n%s\n",
+                "="*60, SEVERITY_ICON[alert['severity']], "="*60,
+                alert['alert_id'],
+                machine_id,
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(data['timestamp'] / 1000)),
+                alert['severity'],
+                alert['anomaly_score'],
+                metrics,
+                alert['recommendation'], "="*60
+            )
     
     def calculate_severity(self, score):
         """Calculate alert severity based on anomaly score"""
@@ -205,16 +350,13 @@ class MLPredictiveMonitor:
     
     def get_recommendation(self, data):
         """Generate maintenance recommendation"""
-        issues = []
-        
-        if data["temperature"] > 80:
-            issues.append("Temperature exceeds safe threshold")
-        if data["vibration"] > 4.0:
-            issues.append("Excessive vibration detected")
-        if data["current"] > 15:
-            issues.append("High current draw")
-        if data["rpm"] < 1400:
-            issues.append("RPM below optimal range")
+        values = np.array([
+            data["temperature"],
+            data["vibration"],
+            data["current"],
+            -data["rpm"]
+        ], dtype=np.float32)
+        issues = [MESSAGES[i] for i in np.flatnonzero(values > THRESHOLDS)]
         
         if issues:
             return f"Schedule inspection: {'; '.join(issues)}"
@@ -222,11 +364,9 @@ class MLPredictiveMonitor:
             return "Monitor closely for additional anomalies"
     
     def log_normal_operation(self, machine_id, data):
-        """Log normal operation"""
-        print(f"✓ {machine_id}: Normal operation | "
-              f"T={data['temperature']:.1f}°C, "
-              f"V={data['vibration']:.2f}mm/s, "
-              f"I={data['current']:.1f}A")
+        """Log normal operation (DEBUG level only)"""
+        logger.debug("✓ %s: Normal operation | T=%.1f°C, V=%.2fmm/s, I=%.1fA",
+                     machine_id, data['temperature'], data['vibration'], data['current'])
     
     def print_statistics(self):
         """Print monitoring statistics"""
@@ -237,11 +377,20 @@ class MLPredictiveMonitor:
         print(f"Anomalies Detected: {self.anomalies_detected}")
         print(f"Anomaly Rate: {(self.anomalies_detected/max(self.total_readings,1))*100:.2f}%")
         print(f"Machines Monitored: {len(self.machine_data)}")
+        print(f"Dropped Messages: {self.dropped_messages}")
         print(f"Model Status: {'✓ Trained' if self.model_trained else '⏳ Training...'}")
         print("="*60 + "\n")
     
-    def run(self, broker="broker.hivemq.com", port=1883):
-        """Start the monitoring system"""
+    def run(self, broker="broker.hivemq.com", port=1883, pin_cpu=None, realtime=False):
+        """
+        Start the monitoring system
+        
+        Args:
+            broker: MQTT broker host
+            port: MQTT broker port
+            pin_cpu: CPU core to pin the MQTT network thread to (None = no pinning)
+            realtime: Run the pinned network thread with SCHED_FIFO priority
+        """
         print("="*60)
         print("🤖 ML PREDICTIVE MAINTENANCE MONITOR")
         print("="*60)
@@ -258,6 +407,14 @@ class MLPredictiveMonitor:
             
             self.client.loop_start()
             
+            if pin_cpu is not None:
+                pinned, realtime_enabled = pin_thread(self.client._thread, pin_cpu, realtime)
+                report_pinning(pinned, realtime_enabled, pin_cpu, realtime)
+            
+            # Start batched anomaly detection worker
+            self._worker = threading.Thread(target=self.process_pending, daemon=True)
+            self._worker.start()
+            
             while True:
                 time.sleep(1)
                 
@@ -270,10 +427,24 @@ class MLPredictiveMonitor:
             print("\n\n🛑 Monitor stopped by user")
             self.print_statistics()
         finally:
+            self._stop_event.set()
             self.client.loop_stop()
             self.client.disconnect()
             print("✓ Disconnected from MQTT broker")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ML predictive maintenance monitor")
+    parser.add_argument("--pin-cpu", type=int, default=None,
+                        help="Pin the MQTT network thread to this CPU core")
+    parser.add_argument("--realtime", action="store_true",
+                        help="Use SCHED_FIFO for the pinned thread (needs CAP_SYS_NICE)")
+    args = parser.parse_args()
+    
+    # Use logging.DEBUG to also show normal-operation readings
+    log_listener = setup_logging(logging.INFO)
+    
     monitor = MLPredictiveMonitor()
-    monitor.run()
+    try:
+        monitor.run(pin_cpu=args.pin_cpu, realtime=args.realtime)
+    finally:
+        log_listener.stop()
@@ -0,0 +1,109 @@
+"""
+MQTT Socket Tuning
+Low-level socket and thread options shared by the simulator, ML monitor and dashboard
+"""
+
+import os
+import socket
+
+# Kernel send/receive buffer size - large enough to absorb publish bursts
+SOCKET_BUFFER_SIZE = 2 * 1024 * 1024
+
+# paho in-flight window (QoS > 0) and outgoing queue limit (0 = unlimited)
+MAX_INFLIGHT_MESSAGES = 200
+MAX_QUEUED_MESSAGES = 0
+
+# SCHED_FIFO priority for pinned network threads (1-99)
+REALTIME_PRIORITY = 50
+
+def configure_client(client):
+    """
+    Raise paho's internal message limits (call before connecting)
+    
+    Args:
+        client: paho MQTT client
+    """
+    client.max_inflight_messages_set(MAX_INFLIGHT_MESSAGES)
+    client.max_queued_messages_set(MAX_QUEUED_MESSAGES)
+
+def tune_socket(client):
+    """
+    Apply socket options to a connected MQTT client
+    
+    paho opens a new socket on every (re)connect, so call this from the
+    on_connect callback.
+    
+    Args:
+        client: Connected paho MQTT client
+    
+    Returns:
+        True if the options were applied, False if the socket is not open
+    """
+    sock = client.socket()
+    if sock is None:
+        return False
+    
+    # Disable Nagle's algorithm - sensor messages are small and latency sensitive
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    
+    # Larger kernel buffers so bursts are not dropped or blocked
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+    
+    return True
+
+def pin_thread(thread, cpu, realtime=False):
+    """
+    Pin a running thread to one CPU core (Linux only)
+    
+    Args:
+        thread: Started threading.Thread, e.g. paho's loop thread (client._thread)
+        cpu: CPU core index to pin to
+        realtime: Also switch the thread to SCHED_FIFO (needs CAP_SYS_NICE)
+    
+    Returns:
+        (pinned, realtime_enabled) - each False if unsupported or not permitted;
+        realtime_enabled is always False when realtime was not requested
+    """
+    if thread is None or thread.native_id is None or not hasattr(os, "sched_setaffinity"):
+        return False, False
+    
+    try:
+        os.sched_setaffinity(thread.native_id, {cpu})
+    except OSError:
+        return False, False
+    
+    if not realtime:
+        return True, False
+    
+    # Without CAP_SYS_NICE this fails with EPERM; the affinity still applies
+    try:
+        os.sched_setscheduler(
+            thread.native_id,
+            os.SCHED_FIFO,
+            os.sched_param(REALTIME_PRIORITY)
+        )
+    except OSError:
+        return True, False
+    
+    return True, True
+
+def report_pinning(pinned, realtime_enabled, cpu, realtime):
+    """
+    Print the outcome of pin_thread() for a network thread
+    
+    Args:
+        pinned, realtime_enabled: Result of pin_thread()
+        cpu: CPU core that was requested
+        realtime: Whether SCHED_FIFO was requested
+    """
+    if pinned:
+        print(f"✓ MQTT network thread pinned to CPU {cpu}")
+    else:
+        print(f"⚠️  Could not pin MQTT network thread to CPU {cpu}")
+    
+    if realtime and pinned:
+        if realtime_enabled:
+            print("✓ MQTT network thread running with SCHED_FIFO priority")
+        else:
+            print("⚠️  Could not enable SCHED_FIFO (needs root or CAP_SYS_NICE)")
@@ -0,0 +1,39 @@
+"""
+Sensor Message Schema
+Compact wire keys used on the MQTT sensor topics
+"""
+
+# Topic carrying one message with the readings of every machine
+FLEET_TOPIC = "factory/fleet/sensors"
+
+# Wire key -> full field name
+SENSOR_KEYS = {
+    "m": "machine_id",
+    "ts": "timestamp",  # Unix time in milliseconds
+    "t": "temperature",
+    "v": "vibration",
+    "c": "current",
+    "p": "pressure",
+    "r": "rpm",
+    "h": "runtime_hours",
+    "d": "degradation_level"
+}
+
+# Numeric fields are sent as fixed-point integers: wire value = round(value * scale)
+FIXED_POINT_SCALE = {
+    "t": 100,
+    "v": 100,
+    "c": 100,
+    "p": 100,
+    "r": 1,
+    "h": 100,
+    "d": 100
+}
+
+def expand_reading(reading):
+    """Convert a compact wire reading to full field names and physical units"""
+    return {
+        SENSOR_KEYS.get(key, key):
+            value / FIXED_POINT_SCALE[key] if key in FIXED_POINT_SCALE else value
+        for key, value in reading.items()
+    }
@@ -4,52 +4,78 @@ Publishes sensor data via MQTT without any physical hardware
 """
 
 import paho.mqtt.client as mqtt
+import argparse
+from mqtt_tuning import configure_client, pin_thread, report_pinning, tune_socket
+from sensor_schema import FLEET_TOPIC, FIXED_POINT_SCALE, expand_reading
 import time
 import random
-import json
+import orjson
 import math
-from datetime import datetime
+import numpy as np
 
-class VirtualIndustrialMachine:
-    """Simulates an industrial machine with sensors"""
+# Wire fields produced per machine, in column order
+SENSOR_FIELDS = ("t", "v", "c", "p", "r", "h", "d")
+SENSOR_SCALE = np.array([FIXED_POINT_SCALE[field] for field in SENSOR_FIELDS])
+
+class FleetSimulator:
+    """Simulates a fleet of industrial machines, computing all sensors per tick in NumPy"""
     
-    def __init__(self, machine_id, failure_mode=False):
-        self.machine_id = machine_id
-        self.failure_mode = failure_mode
-        self.runtime_hours = 0
+    def __init__(self, num_machines, failure_machines=(), seed=None):
+        self.num_machines = num_machines
+        self.machine_ids = [f"MACHINE_{i+1:03d}" for i in range(num_machines)]
+        self.rng = np.random.default_rng(seed)
+        
+        # Machines operating in failure mode
+        self.failure_mode = np.zeros(num_machines, dtype=bool)
+        self.failure_mode[list(failure_machines)] = True
+        
+        self.runtime_hours = np.zeros(num_machines)
         self.cycle_count = 0
         
         # Normal operating parameters
-        self.base_temp = 65.0
-        self.base_vibration = 2.0
-        self.base_current = 10.0
+        self.base_temp = np.full(num_machines, 65.0)
+        self.base_vibration = np.full(num_machines, 2.0)
+        self.base_current = np.full(num_machines, 10.0)
         
         # Degradation tracking
-        self.degradation_factor = 0.0
+        self.degradation_factor = np.zeros(num_machines)
         
-    def simulate_readings(self):
-        """Generate realistic sensor readings"""
+    def simulate_readings(self, now=None, hour=None):
+        """
+        Generate realistic sensor readings for every machine
+        
+        Args:
+            now: Tick time from time.time() (default: current time)
+            hour: Local hour of the tick (default: derived from now)
+        """
+        if now is None:
+            now = time.time()
+        if hour is None:
+            hour = time.localtime(now).tm_hour
         
         # Simulate time-of-day effects
-        hour = datetime.now().hour
         daily_load_factor = 1.0 + 0.2 * math.sin(2 * math.pi * hour / 24)
         
         # Add gradual degradation
-        if self.failure_mode:
-            self.degradation_factor += random.uniform(0.001, 0.005)
+        self.degradation_factor += self.failure_mode * self.rng.uniform(
+            0.001, 0.005, self.num_machines
+        )
+        
+        # Normal sensor noise, one column per sensor
+        noise = self.rng.standard_normal((self.num_machines, 5))
         
         # Temperature (°C)
         temperature = (
             self.base_temp * daily_load_factor +
             self.degradation_factor * 15 +  # Overheating as it degrades
-            random.gauss(0, 2)  # Normal sensor noise
+            2 * noise[:, 0]
         )
         
         # Vibration (mm/s)
         vibration = (
             self.base_vibration +
             self.degradation_factor * 3 +  # Increased vibration when degraded
-            random.gauss(0, 0.3) +
+            0.3 * noise[:, 1] +
             0.5 * math.sin(self.cycle_count * 0.1)  # Cyclic pattern
         )
         
@@ -57,29 +83,36 @@ class VirtualIndustrialMachine:
         current = (
             self.base_current * daily_load_factor +
             self.degradation_factor * 5 +  # Higher current draw
-            random.gauss(0, 0.5)
+            0.5 * noise[:, 2]
         )
         
         # Pressure (Bar) - optional
-        pressure = 6.0 + random.gauss(0, 0.2)
+        pressure = 6.0 + 0.2 * noise[:, 3]
         
         # RPM
-        rpm = 1500 + random.gauss(0, 50) - (self.degradation_factor * 100)
+        rpm = 1500 + 50 * noise[:, 4] - (self.degradation_factor * 100)
         
         self.cycle_count += 1
         self.runtime_hours += 0.001  # Increment slightly
         
-        return {
-            "machine_id": self.machine_id,
-            "timestamp": datetime.now().isoformat(),
-            "temperature": round(temperature, 2),
-            "vibration": round(vibration, 2),
-            "current": round(current, 2),
-            "pressure": round(pressure, 2),
-            "rpm": round(rpm, 0),
-            "runtime_hours": round(self.runtime_hours, 2),
-            "degradation_level": round(self.degradation_factor * 100, 1)
-        }
+        # Encode all machines as fixed-point integers in one pass
+        values = np.column_stack([
+            temperature,
+            vibration,
+            current,
+            pressure,
+            rpm,
+            self.runtime_hours,
+            self.degradation_factor * 100
+        ])
+        rows = np.rint(values * SENSOR_SCALE).astype(np.int64).tolist()
+        
+        # Compact keys, see sensor_schema.SENSOR_KEYS
+        timestamp = int(now * 1000)
+        return [
+            {"m": machine_id, "ts": timestamp, **dict(zip(SENSOR_FIELDS, row))}
+            for machine_id, row in zip(self.machine_ids, rows)
+        ]
 
 class SensorPublisher:
     """Publishes simulated sensor data via MQTT"""
@@ -90,10 +123,12 @@ class SensorPublisher:
         self.client = mqtt.Client(client_id=f"sensor_sim_{random.randint(1000,9999)}")
         self.client.on_connect = self.on_connect
         self.client.on_disconnect = self.on_disconnect
+        configure_client(self.client)
         
     def on_connect(self, client, userdata, flags, rc):
         if rc == 0:
             print(f"✓ Connected to MQTT Broker at {self.broker}")
+            tune_socket(client)
         else:
             print(f"✗ Connection failed with code {rc}")
     
@@ -112,18 +147,34 @@ class SensorPublisher:
             print(f"Connection error: {e}")
             return False
     
-    def publish(self, topic, data):
+    def publish(self, topic, data, qos=1):
         """Publish data to MQTT topic"""
-        payload = json.dumps(data)
-        result = self.client.publish(topic, payload, qos=1)
+        payload = orjson.dumps(data)
+        result = self.client.publish(topic, payload, qos=qos)
         return result.rc == mqtt.MQTT_ERR_SUCCESS
     
+    def publish_many(self, messages, qos=1):
+        """
+        Publish several messages back-to-back on the persistent connection
+        
+        Args:
+            messages: Iterable of (topic, data) pairs
+            qos: QoS level for every message
+        """
+        # Encode everything up front so the publish calls run in a tight loop
+        payloads = [(topic, orjson.dumps(data)) for topic, data in messages]
+        
+        publish = self.client.publish
+        results = [publish(topic, payload, qos=qos) for topic, payload in payloads]
+        return all(result.rc == mqtt.MQTT_ERR_SUCCESS for result in results)
+    
     def disconnect(self):
         """Disconnect from broker"""
         self.client.loop_stop()
         self.client.disconnect()
 
-def run_simulation(num_machines=3, interval_seconds=2, duration_minutes=None):
+def run_simulation(num_machines=3, interval_seconds=2, duration_minutes=None,
+                   per_machine_topics=False, pin_cpu=None, realtime=False):
     """
     Run the complete sensor simulation
     
@@ -131,6 +182,10 @@ def run_simulation(num_machines=3, interval_seconds=2, duration_minutes=None):
         num_machines: Number of machines to simulate
         interval_seconds: Time between sensor readings
         duration_minutes: How long to run (None = forever)
+        per_machine_topics: Publish each machine to its own topic instead of
+            one fleet message (legacy format)
+        pin_cpu: CPU core to pin the MQTT network thread to (None = no pinning)
+        realtime: Run the pinned network thread with SCHED_FIFO priority
     """
     
     print("=" * 60)
@@ -147,19 +202,15 @@ def run_simulation(num_machines=3, interval_seconds=2, duration_minutes=None):
         print("Failed to connect to MQTT broker. Exiting.")
         return
     
-    # Create virtual machines
-    machines = []
-    for i in range(num_machines):
-        # Make one machine operate in failure mode
-        failure_mode = (i == num_machines - 1)
-        machine = VirtualIndustrialMachine(
-            machine_id=f"MACHINE_{i+1:03d}",
-            failure_mode=failure_mode
-        )
-        machines.append(machine)
-        
-        if failure_mode:
-            print(f"⚠️  {machine.machine_id} is in DEGRADATION MODE (will show anomalies)")
+    if pin_cpu is not None:
+        pinned, realtime_enabled = pin_thread(publisher.client._thread, pin_cpu, realtime)
+        report_pinning(pinned, realtime_enabled, pin_cpu, realtime)
+    
+    # Create virtual machines, making one operate in failure mode
+    failure_machines = [num_machines - 1] if num_machines > 0 else []
+    fleet = FleetSimulator(num_machines, failure_machines=failure_machines)
+    for i in np.flatnonzero(fleet.failure_mode):
+        print(f"⚠️  {fleet.machine_ids[i]} is in DEGRADATION MODE (will show anomalies)")
     
     print("\n📡 Starting data transmission...\n")
     
@@ -168,38 +219,34 @@ def run_simulation(num_machines=3, interval_seconds=2, duration_minutes=None):
     
     try:
         while True:
+            # Tick time, shared by every reading in this tick
+            now = time.time()
+            hour = time.localtime(now).tm_hour
+            
             # Check duration
             if duration_minutes:
-                elapsed = (time.time() - start_time) / 60
+                elapsed = (now - start_time) / 60
                 if elapsed >= duration_minutes:
                     print(f"\n✓ Simulation completed ({duration_minutes} minutes)")
                     break
             
-            # Generate and publish readings for each machine
-            for machine in machines:
-                readings = machine.simulate_readings()
-                
-                # Publish to different topics
-                publisher.publish(
-                    f"factory/machines/{machine.machine_id}/sensors",
-                    readings
+            # Generate readings for every machine and publish them, either as
+            # one fleet message or one message per machine (never both)
+            fleet_readings = fleet.simulate_readings(now, hour)
+            if per_machine_topics:
+                publisher.publish_many(
+                    (f"factory/machines/{readings['m']}/sensors", readings)
+                    for readings in fleet_readings
                 )
-                
-                # Also publish individual metrics for flexibility
-                publisher.publish(
-                    f"factory/sensors/temperature",
-                    {
-                        "machine_id": machine.machine_id,
-                        "value": readings["temperature"],
-                        "timestamp": readings["timestamp"]
-                    }
-                )
-                
+            else:
+                publisher.publish(FLEET_TOPIC, fleet_readings, qos=0)
+            
+            for readings in map(expand_reading, fleet_readings):
                 # Display status
                 status_icon = "🔴" if readings["degradation_level"] > 50 else \
                               "🟡" if readings["degradation_level"] > 20 else "🟢"
                 
-                print(f"{status_icon} {machine.machine_id}: "
+                print(f"{status_icon} {readings['machine_id']}: "
                       f"Temp={readings['temperature']:.1f}°C, "
                       f"Vib={readings['vibration']:.2f}mm/s, "
                       f"Curr={readings['current']:.1f}A, "
@@ -218,6 +265,15 @@ def run_simulation(num_machines=3, interval_seconds=2, duration_minutes=None):
         print(f"✓ Total readings published: {reading_count}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Industrial IoT sensor simulator")
+    parser.add_argument("--pin-cpu", type=int, default=None,
+                        help="Pin the MQTT network thread to this CPU core")
+    parser.add_argument("--realtime", action="store_true",
+                        help="Use SCHED_FIFO for the pinned thread (needs CAP_SYS_NICE)")
+    parser.add_argument("--per-machine-topics", action="store_true",
+                        help="Publish one message per machine instead of a fleet message")
+    args = parser.parse_args()
+    
     # Configuration
     NUM_MACHINES = 3
     INTERVAL_SECONDS = 3
@@ -226,5 +282,8 @@ if __name__ == "__main__":
     run_simulation(
         num_machines=NUM_MACHINES,
         interval_seconds=INTERVAL_SECONDS,
-        duration_minutes=DURATION_MINUTES
+        duration_minutes=DURATION_MINUTES,
+        per_machine_topics=args.per_machine_topics,
+        pin_cpu=args.pin_cpu,
+        realtime=args.realtime
     )